@@ -0,0 +1,123 @@
+# analytics.py — 由本地日线价格估计风险参数（年化收益/波动、协方差/相关系数、最大回撤），供模拟器使用
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+TRADING_DAYS = 252
+
+# 估计结果缓存：(标的组合, 窗口, 历史数据版本) -> dict
+_CACHE_SIZE = 64
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def align_closes(series):
+    """
+    series: {symbol: (日期序号 int 数组, 收盘价 float 数组)}，日期升序。
+    取所有标的共同交易日，返回 (symbols, dates, closes[T, N])。
+    """
+    symbols = sorted(series)
+    if not symbols:
+        return symbols, np.empty(0, dtype=np.int64), np.empty((0, 0))
+    common = series[symbols[0]][0]
+    for s in symbols[1:]:
+        common = np.intersect1d(common, series[s][0], assume_unique=True)
+    closes = np.empty((common.shape[0], len(symbols)))
+    for j, s in enumerate(symbols):
+        d, c = series[s]
+        closes[:, j] = c[np.searchsorted(d, common)]
+    return symbols, common, closes
+
+
+def max_drawdown(closes):
+    """逐列最大回撤（正数，0.3 表示最多回撤 30%）"""
+    peak = np.maximum.accumulate(closes, axis=0)
+    return np.max(1.0 - closes / peak, axis=0)
+
+
+def estimate(closes, periods_per_year: int = TRADING_DAYS):
+    """
+    closes[T, N] -> 年化统计。对数收益率矩阵 R[T-1, N] 上一次算完：
+      mu     —— GBM 漂移（= 对数收益年化均值 + σ²/2，与模拟器的 mu 同口径）
+      annual_return —— 几何年化收益 exp(对数均值×年化系数) - 1
+      sigma / cov / corr —— 年化波动、协方差、相关系数
+    """
+    rets = np.diff(np.log(closes), axis=0)
+    log_mu = rets.mean(axis=0) * periods_per_year
+    cov = np.atleast_2d(np.cov(rets, rowvar=False)) * periods_per_year
+    sigma = np.sqrt(np.diag(cov))
+    denom = np.outer(sigma, sigma)
+    corr = np.divide(cov, denom, out=np.eye(cov.shape[0]), where=denom > 0)
+    return {
+        "mu": log_mu + sigma ** 2 / 2.0,
+        "annual_return": np.expm1(log_mu),
+        "sigma": sigma,
+        "cov": cov,
+        "corr": corr,
+        "max_drawdown": max_drawdown(closes),
+        "observations": int(rets.shape[0]),
+    }
+
+
+def risk_params(symbols, window: int, version, load_series):
+    """
+    按 (标的组合, 窗口, 数据版本) 缓存的风险参数。
+    load_series(symbols) -> {symbol: (日期序号, 收盘价)}；少于 2 个共同交易日的组合返回 None。
+    """
+    key = (tuple(sorted(set(symbols))), int(window), version)
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit
+    series = {s: v for s, v in load_series(key[0]).items() if len(v[0]) >= 2}
+    syms, dates, closes = align_closes(series)
+    if closes.shape[0] < 3:
+        result = None
+    else:
+        closes = closes[-(window + 1):]
+        result = {"symbols": syms, "start": int(dates[-closes.shape[0]]), "end": int(dates[-1]),
+                  "missing": [s for s in key[0] if s not in syms], **estimate(closes)}
+    with _lock:
+        _cache[key] = result
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def nearest_psd(cov):
+    """特征值截断到非负，保证能做 Cholesky（估计/拼接出来的矩阵可能略微非正定）"""
+    w, v = np.linalg.eigh((cov + cov.T) / 2.0)
+    return (v * np.maximum(w, 1e-12)) @ v.T
+
+
+# 单块随机数最多这么多个 float64（约 16 MB），路径按块生成，峰值内存与总路径数无关
+SIM_CHUNK_CELLS = 2_000_000
+
+
+def simulate_paths(weights, mu, cov, start_value, years: int, steps_per_year: int, n_paths: int, seed=None):
+    """
+    多资产相关 GBM，按目标权重每步再平衡。返回每年末组合价值矩阵 (n_paths, years)。
+    路径分块模拟，每块的临时数组不超过 SIM_CHUNK_CELLS 个元素。
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.asarray(weights, dtype=float)
+    mu = np.asarray(mu, dtype=float)
+    cov = np.atleast_2d(np.asarray(cov, dtype=float))
+    dt = 1.0 / steps_per_year
+    chol = np.linalg.cholesky(nearest_psd(cov)).T * np.sqrt(dt)
+    drift = (mu - np.diag(cov) / 2.0) * dt
+    steps = years * steps_per_year
+    chunk = max(1, SIM_CHUNK_CELLS // (steps * mu.shape[0]))
+
+    out = np.empty((n_paths, years))
+    for lo in range(0, n_paths, chunk):
+        hi = min(n_paths, lo + chunk)
+        z = rng.standard_normal((steps, hi - lo, mu.shape[0])) @ chol
+        z += drift
+        np.exp(z, out=z)
+        gross = z @ weights                                   # (steps, 块内路径数) 每步组合增长倍数
+        wealth = start_value * np.cumprod(gross, axis=0)
+        out[lo:hi] = wealth[steps_per_year - 1::steps_per_year].T
+    return out
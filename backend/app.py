@@ -1,37 +1,90 @@
 # app.py
 # ====== 我的家庭财务中心 · 后端最小可用版（含真实/占位 行情搜索切换） ======
+import itertools
 import os
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 from typing import List, Dict
-from price_providers import smart_quote, alpha_search, QuoteResult
 
-import requests
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, Response, current_app, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func
+from sqlalchemy import column, event, func, inspect, literal, literal_column, select, table, text
+from sqlalchemy.orm import Session
+
+import fts
 
 # ---------------- 基础初始化 ----------------
-app = Flask(__name__)
-# 上线后建议把 * 换成你的 Netlify 域名，如 {"origins": ["https://eun-young.netlify.app"]}
-CORS(app, resources={r"/*": {"origins": "*"}})
+# 应用工厂：import 本模块不建 app、不连库；行情模块在第一次搜索/报价时才加载
+db = SQLAlchemy()
+bp = Blueprint("api", __name__)
 
-# SQLite 放在 backend/data.sqlite
+# SQLite 默认放在 backend/data.sqlite，可用 SQLITE_PATH 覆盖（基准测试/本地调试用）
 basedir = os.path.abspath(os.path.dirname(__file__))
-db_path = os.path.join(basedir, "data.sqlite")
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+db_path = os.getenv("SQLITE_PATH") or os.path.join(basedir, "data.sqlite")
 
-db = SQLAlchemy(app)
+# 表结构版本：写进 PRAGMA user_version，版本一致时跳过 create_all
+SCHEMA_VERSION = 6
 
 # 读取行情服务 Key（可不配，不配时走占位数据）
 TD_API_KEY = os.getenv("TD_API_KEY", "").strip()
 
+
+def create_app(config: Dict = None) -> Flask:
+    app = Flask(__name__)
+    # 上线后建议把 * 换成你的 Netlify 域名，如 {"origins": ["https://eun-young.netlify.app"]}
+    CORS(app, resources={r"/*": {"origins": "*"}})
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # 收支明细的进程内列式缓存（单 worker 部署时开启）
+    app.config["LEDGER_CACHE"] = os.getenv("LEDGER_CACHE", "").strip() == "1"
+    if config:
+        app.config.update(config)
+
+    db.init_app(app)
+    # 健康检查不经过 bp.before_request，不碰数据库
+    app.add_url_rule("/health", "health", health)
+    app.register_blueprint(bp)
+
+    # 后台线程把最后已知价格载入内存，首个报价请求不用等网络
+    from quote_store import warm_in_background
+    warm_in_background()
+
+    # 开启明细缓存时，启动即从 SQLite 全量构建一次
+    if app.config["LEDGER_CACHE"]:
+        with app.app_context():
+            ensure_schema()
+            rebuild_ledger_cache()
+    return app
+
 # ---------------- 健康检查 ----------------
-@app.get("/health")
 def health():
     return jsonify({"ok": True})
 
+# ---------------- 表结构检查（每个进程只做一次） ----------------
+_schema_lock = threading.Lock()
+
+@bp.before_request
+def ensure_schema():
+    """第一次业务请求时检查表结构；user_version 已是最新则不跑 DDL"""
+    state = current_app.extensions.setdefault("finance_schema", {"ready": False})
+    if state["ready"]:
+        return
+    with _schema_lock:
+        if state["ready"]:
+            return
+        version = db.session.execute(text("PRAGMA user_version")).scalar() or 0
+        if version < SCHEMA_VERSION:
+            db.create_all()
+            try:
+                fts.install(db.session.connection())
+            except Exception as e:          # SQLite 未编译 FTS5 时全文检索不可用，其它功能照常
+                print("[schema] FTS5 unavailable:", e)
+            db.session.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+            db.session.commit()
+        state["ready"] = True
+
 # ---------------- 数据模型 ----------------
 class BudgetRule(db.Model):
     __tablename__ = "budget_rules"
@@ -136,6 +189,81 @@ class Snapshot(db.Model):
             "created_at": self.created_at.strftime('%Y-%m-%d')
         }
 
+
+class AppMeta(db.Model):
+    """全局计数器（如规则版本号），多 worker 共享"""
+    __tablename__ = "app_meta"
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PriceHistory(db.Model):
+    """本地日线收盘价（风险参数估计用），按 (symbol, date) 唯一"""
+    __tablename__ = "price_history"
+    __table_args__ = (db.UniqueConstraint("symbol", "date", name="uq_price_history_symbol_date"),)
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(50), nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+    close = db.Column(db.Float, nullable=False)
+
+
+class ChangeLog(db.Model):
+    """变更日志：id 即同步游标；由 after_flush 钩子在同一事务内写入"""
+    __tablename__ = "change_log"
+    # AUTOINCREMENT：日志被压缩清空后 id 也不会从 1 重新开始，游标只增不减
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)              # insert / update / delete
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# ---------------- 变更日志（供 /api/changes 增量同步） ----------------
+# 这些表的增删改都会记一条；所有写接口都走 db.session，所以在 flush 时统一记录即可
+CHANGE_TRACKED = {
+    "budget_entries": BudgetEntry,
+    "budget_rules": BudgetRule,
+    "assets": Asset,
+    "snapshots": Snapshot,
+}
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session, flush_context):
+    rows = []
+    for op, objs in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objs:
+            name = getattr(obj, "__tablename__", None)
+            if name not in CHANGE_TRACKED:
+                continue
+            if op == "update" and not session.is_modified(obj, include_collections=False):
+                continue
+            rows.append({"table_name": name, "row_id": obj.id, "op": op, "created_at": datetime.utcnow()})
+    if rows:
+        session.connection().execute(ChangeLog.__table__.insert(), rows)
+
+# 全文索引同步：明细 / 规则的 category、note 有增删改时，同一事务内更新 FTS 表
+FTS_INDEXED = {"budget_entries": BudgetEntry, "budget_rules": BudgetRule}
+
+@event.listens_for(Session, "after_flush")
+def _sync_fts(session, flush_context):
+    changes = {}
+    for op, objs in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+        for obj in objs:
+            name = getattr(obj, "__tablename__", None)
+            if name not in FTS_INDEXED:
+                continue
+            removed, rows = changes.setdefault(name, (set(), []))
+            if op == "delete":
+                removed.add(obj.id)
+                continue
+            if op == "update":
+                state = inspect(obj)
+                if not (state.attrs.category.history.has_changes() or state.attrs.note.history.has_changes()):
+                    continue
+            rows.append((obj.id, obj.category, obj.note))
+    if changes:
+        fts.sync(session.connection(), changes)
+
 # ---------------- 占位证券目录（仅在无 API Key 时用于演示搜索） ----------------
 SECURITY_CATALOG: List[Dict] = [
     # 中国 ETF/基金（示例）
@@ -158,6 +286,49 @@ def compute_total_value() -> float:
     except Exception:
         return 0.0
 
+def get_meta(key: str) -> int:
+    row = db.session.get(AppMeta, key)
+    return int(row.value) if row else 0
+
+def bump_meta(key: str) -> None:
+    """计数器 +1，随当前事务一起提交"""
+    row = db.session.get(AppMeta, key)
+    if row is None:
+        db.session.add(AppMeta(key=key, value=1))
+    else:
+        row.value = int(row.value) + 1
+
+def load_rule_tuples():
+    return [(r.type, r.amount, r.start_date, r.end_date, r.growth_rate) for r in BudgetRule.query.all()]
+
+def plan_cashflows(y: int, m: int, months: int):
+    """规则现金流向量 (income, expense)，按 rules_version 缓存"""
+    import planning
+    return planning.cached_cashflows(get_meta("rules_version"), y, m, months, load_rule_tuples)
+
+def get_ledger():
+    """明细缓存（未开启时为 None）"""
+    return current_app.extensions.get("ledger_cache")
+
+def rebuild_ledger_cache():
+    from ledger_cache import LedgerCache
+    cache = current_app.extensions.get("ledger_cache") or LedgerCache()
+    rows = db.session.query(BudgetEntry.id, BudgetEntry.date, BudgetEntry.type,
+                            BudgetEntry.category, BudgetEntry.amount, BudgetEntry.note)
+    cache.rebuild(rows)
+    current_app.extensions["ledger_cache"] = cache
+    return cache
+
+def ledger_upsert(entries):
+    ledger = get_ledger()
+    if ledger is not None:
+        ledger.upsert_many([(e.id, e.date, e.type, e.category, e.amount, e.note) for e in entries])
+
+def ledger_remove(entry_ids):
+    ledger = get_ledger()
+    if ledger is not None:
+        ledger.remove_many(entry_ids)
+
 def parse_date(s: str) -> datetime:
     return datetime.strptime(s, "%Y-%m-%d")
 
@@ -215,28 +386,91 @@ def normalize_symbol(raw: str) -> str:
         return f"{s}.SH"
     return s
 
+# ---------------- 请求体 -> 字段（单条与批量接口共用） ----------------
+# partial=True 用于更新：只解析请求里出现的字段；否则按新建补默认值
+def _month_or_none(s):
+    return ym_to_dt(*parse_month(s)) if s else None
+
+def _date_or_none(s):
+    return parse_date(s) if s else None
+
+def rule_fields(data: Dict, partial: bool = False) -> Dict:
+    has = lambda k: not partial or k in data
+    f = {}
+    if has('type'):
+        f['type'] = data.get('type') or '支出'
+    if has('category'):
+        f['category'] = data.get('category') or '未分类'
+    if has('amount'):
+        f['amount'] = float(data.get('amount') or 0.0)
+    if has('start_month'):
+        f['start_date'] = ym_to_dt(*parse_month(data.get('start_month')))
+    if has('end_month'):
+        f['end_date'] = _month_or_none(data.get('end_month'))
+    if has('growth_rate'):
+        f['growth_rate'] = float(data.get('growth_rate') or 0.0)
+    if has('note'):
+        f['note'] = (data.get('note') or '').strip() or None
+    return f
+
+def entry_fields(data: Dict, partial: bool = False) -> Dict:
+    has = lambda k: not partial or k in data
+    f = {}
+    if has('date'):
+        f['date'] = parse_date((data.get('date') or '').strip())
+    if has('type'):
+        f['type'] = data.get('type') or '支出'
+    if has('category'):
+        f['category'] = data.get('category') or '未分类'
+    if has('amount'):
+        f['amount'] = float(data.get('amount') or 0.0)
+    if has('note'):
+        f['note'] = (data.get('note') or '').strip() or None
+    return f
+
+def asset_fields(data: Dict, partial: bool = False) -> Dict:
+    has = lambda k: not partial or k in data
+    f = {}
+    if has('name'):
+        f['name'] = data.get('name') or '未命名资产'
+    if has('type'):
+        f['type'] = data.get('type') or '其他'
+    if has('asset_style'):
+        f['asset_style'] = data.get('asset_style') or 'manual'
+    if has('symbol'):
+        f['symbol'] = normalize_symbol(data.get('symbol') or "") or None
+    for k in ('quantity', 'rate', 'compounding', 'contribution', 'contribution_freq'):
+        if has(k):
+            f[k] = data.get(k) or None
+    for k in ('start_date', 'end_date'):
+        if has(k):
+            f[k] = _date_or_none(data.get(k))
+    if partial:
+        for k in ('total_cost', 'current_value'):
+            if k in data:
+                f[k] = float(data.get(k) or 0.0)
+    else:
+        f['total_cost'] = f['current_value'] = float(data.get('initial_cost') or 0.0)
+    return f
+
+def apply_asset_tx(a: Asset, data: Dict) -> None:
+    """最小兼容：买入 -> total_cost 增加；卖出 -> total_cost 减少(不小于0)"""
+    t = (data.get('type') or '买入').strip()
+    amt = float(data.get('amount') or 0.0)
+    if t == '买入':
+        a.total_cost = float(a.total_cost or 0.0) + amt
+    else:
+        a.total_cost = max(0.0, float(a.total_cost or 0.0) - amt)
+
 # ---------------- 规则 CRUD ----------------
-@app.route('/api/budget/rules', methods=['GET', 'POST'])
+@bp.route('/api/budget/rules', methods=['GET', 'POST'])
 def budget_rules():
     if request.method == 'POST':
         data = request.get_json() or {}
         try:
-            y, m = parse_month(data.get('start_month'))
-            start_dt = ym_to_dt(y, m)
-            end_dt = None
-            if data.get('end_month'):
-                ey, em = parse_month(data['end_month'])
-                end_dt = ym_to_dt(ey, em)
-            row = BudgetRule(
-                type=data.get('type') or '支出',
-                category=data.get('category') or '未分类',
-                amount=float(data.get('amount') or 0.0),
-                start_date=start_dt,
-                end_date=end_dt,
-                growth_rate=float(data.get('growth_rate') or 0.0),
-                note=(data.get('note') or '').strip() or None
-            )
+            row = BudgetRule(**rule_fields(data))
             db.session.add(row)
+            bump_meta("rules_version")
             db.session.commit()
             return jsonify(row.to_json()), 201
         except Exception as e:
@@ -245,15 +479,16 @@ def budget_rules():
     rows = BudgetRule.query.order_by(BudgetRule.start_date.asc(), BudgetRule.id.asc()).all()
     return jsonify([r.to_json() for r in rows])
 
-@app.route('/api/budget/rules/<int:rule_id>', methods=['DELETE'])
+@bp.route('/api/budget/rules/<int:rule_id>', methods=['DELETE'])
 def budget_rules_delete(rule_id):
     r = BudgetRule.query.get_or_404(rule_id)
     db.session.delete(r)
+    bump_meta("rules_version")
     db.session.commit()
     return jsonify({"message": "deleted"})
 
 # ---------------- 一键填充默认项到明细 ----------------
-@app.route('/api/budget/autofill', methods=['POST'])
+@bp.route('/api/budget/autofill', methods=['POST'])
 def budget_autofill():
     data = request.get_json() or {}
     month = (data.get('month') or '').strip()
@@ -291,23 +526,19 @@ def budget_autofill():
         created.append(entry)
 
     db.session.commit()
+    ledger_upsert(created)
     return jsonify([e.to_json() for e in created])
 
 # ---------------- 预算明细 & 汇总 ----------------
-@app.route('/api/budget/entries', methods=['GET', 'POST'])
+@bp.route('/api/budget/entries', methods=['GET', 'POST'])
 def budget_entries():
     if request.method == 'POST':
         data = request.get_json() or {}
         try:
-            row = BudgetEntry(
-                date=parse_date((data.get('date') or '').strip()),
-                type=data.get('type') or '支出',
-                category=data.get('category') or '未分类',
-                amount=float(data.get('amount') or 0.0),
-                note=(data.get('note') or '').strip() or None
-            )
+            row = BudgetEntry(**entry_fields(data))
             db.session.add(row)
             db.session.commit()
+            ledger_upsert([row])
             return jsonify(row.to_json()), 201
         except Exception as e:
             db.session.rollback()
@@ -315,6 +546,10 @@ def budget_entries():
 
     start_s = (request.args.get('start') or '').strip()
     end_s = (request.args.get('end') or '').strip()
+    ledger = get_ledger()
+    if ledger is not None:
+        return jsonify(ledger.rows(parse_date(start_s) if start_s else None,
+                                   parse_date(end_s) if end_s else None))
     q = BudgetEntry.query
     if start_s:
         q = q.filter(BudgetEntry.date >= parse_date(start_s))
@@ -323,17 +558,25 @@ def budget_entries():
     rows = q.order_by(BudgetEntry.date.asc(), BudgetEntry.id.asc()).all()
     return jsonify([r.to_json() for r in rows])
 
-@app.route('/api/budget/entries/<int:entry_id>', methods=['DELETE'])
+@bp.route('/api/budget/entries/<int:entry_id>', methods=['DELETE'])
 def budget_entries_delete(entry_id):
     r = BudgetEntry.query.get_or_404(entry_id)
     db.session.delete(r)
     db.session.commit()
+    ledger_remove([entry_id])
     return jsonify({'message': 'deleted'})
 
-@app.route('/api/budget/summary', methods=['GET'])
+@bp.route('/api/budget/summary', methods=['GET'])
 def budget_summary():
     start_s = (request.args.get('start') or '').strip()
     end_s = (request.args.get('end') or '').strip()
+    ledger = get_ledger()
+    if ledger is not None:
+        totals = ledger.totals(parse_date(start_s) if start_s else None,
+                               parse_date(end_s) if end_s else None)
+        income = totals.get('收入', 0.0)
+        expense = sum(v for k, v in totals.items() if k != '收入')
+        return jsonify({'income': income, 'expense': expense})
     q = BudgetEntry.query
     if start_s:
         q = q.filter(BudgetEntry.date >= parse_date(start_s))
@@ -345,25 +588,14 @@ def budget_summary():
     return jsonify({'income': income, 'expense': expense})
 
 # ---------------- 资产 ----------------
-@app.route('/api/assets', methods=['GET', 'POST'])
+@bp.route('/api/assets', methods=['GET', 'POST'])
 def assets_api():
     if request.method == 'POST':
         data = request.get_json() or {}
-        a = Asset(
-            name=data.get('name') or '未命名资产',
-            type=data.get('type') or '其他',
-            asset_style=data.get('asset_style') or 'manual',
-            symbol=(normalize_symbol(data.get('symbol') or "") or None),
-            quantity=(data.get('quantity') or None),
-            total_cost=float(data.get('initial_cost') or 0.0),
-            current_value=float(data.get('initial_cost') or 0.0),
-            rate=(data.get('rate') or None),
-            compounding=(data.get('compounding') or None),
-            start_date=(parse_date(data['start_date']) if data.get('start_date') else None),
-            end_date=(parse_date(data['end_date']) if data.get('end_date') else None),
-            contribution=(data.get('contribution') or None),
-            contribution_freq=(data.get('contribution_freq') or None),
-        )
+        a = Asset(**asset_fields(data))
+        # 可选：随建随记首笔交易，省掉一次 /transactions 请求
+        if data.get('initial_transaction'):
+            apply_asset_tx(a, data['initial_transaction'])
         db.session.add(a)
         db.session.commit()
         return jsonify(a.to_json()), 201
@@ -371,14 +603,14 @@ def assets_api():
     rows = Asset.query.order_by(Asset.id.asc()).all()
     return jsonify([r.to_json() for r in rows])
 
-@app.route('/api/assets/<int:aid>', methods=['DELETE'])
+@bp.route('/api/assets/<int:aid>', methods=['DELETE'])
 def assets_delete(aid):
     a = Asset.query.get_or_404(aid)
     db.session.delete(a)
     db.session.commit()
     return jsonify({'message': 'deleted'})
 
-@app.route('/api/assets/<int:aid>/value', methods=['PUT'])
+@bp.route('/api/assets/<int:aid>/value', methods=['PUT'])
 def assets_update_value(aid):
     a = Asset.query.get_or_404(aid)
     data = request.get_json() or {}
@@ -386,25 +618,19 @@ def assets_update_value(aid):
     db.session.commit()
     return jsonify(a.to_json())
 
-@app.route('/api/assets/<int:aid>/transactions', methods=['POST'])
+@bp.route('/api/assets/<int:aid>/transactions', methods=['POST'])
 def assets_add_tx(aid):
     """
     最小兼容：买入 -> total_cost 增加；卖出 -> total_cost 减少(不小于0)。
     返回更新后的资产，以满足前端更新视图。
     """
     a = Asset.query.get_or_404(aid)
-    data = request.get_json() or {}
-    t = (data.get('type') or '买入').strip()
-    amt = float(data.get('amount') or 0.0)
-    if t == '买入':
-        a.total_cost = float(a.total_cost) + amt
-    else:
-        a.total_cost = max(0.0, float(a.total_cost) - amt)
+    apply_asset_tx(a, request.get_json() or {})
     db.session.commit()
     return jsonify(a.to_json())
 
 # ---------------- 快照 ----------------
-@app.route('/api/snapshots', methods=['GET', 'POST'])
+@bp.route('/api/snapshots', methods=['GET', 'POST'])
 def snapshots_api():
     if request.method == 'POST':
         total = compute_total_value()
@@ -416,8 +642,545 @@ def snapshots_api():
     rows = Snapshot.query.order_by(Snapshot.created_at.asc(), Snapshot.id.asc()).limit(lim).all()
     return jsonify([r.to_json() for r in rows])
 
+# ---------------- 批量写入 ----------------
+# 请求体：{"create": [{...}], "update": [{"id": 1, ...}], "delete": [1, 2]}
+# 整批一个事务、一次提交；单条解析失败只记在该条结果里，不影响其它条目。
+BATCH_MAX_ITEMS = 1000
+
+def _batch_apply(model, data: Dict, build_fields, on_create=None):
+    """返回 (results, created, updated, deleted_ids)；调用方负责 commit"""
+    creates = data.get('create') or []
+    updates = data.get('update') or []
+    deletes = data.get('delete') or []
+    results, created, updated, deleted_ids = [], [], [], []
+
+    for i, item in enumerate(creates):
+        try:
+            obj = model(**build_fields(item))
+            if on_create:
+                on_create(obj, item)
+            created.append((i, obj))
+        except Exception as e:
+            results.append({"op": "create", "index": i, "ok": False, "error": str(e)})
+
+    ids = [u.get('id') for u in updates if isinstance(u, dict)] + list(deletes)
+    found = {o.id: o for o in model.query.filter(model.id.in_(ids)).all()} if ids else {}
+
+    delete_set = set(deletes)
+    for i, item in enumerate(updates):
+        obj = found.get(item.get('id')) if isinstance(item, dict) else None
+        if obj is None:
+            results.append({"op": "update", "index": i, "ok": False, "error": "not found"})
+            continue
+        if obj.id in delete_set:
+            results.append({"op": "update", "index": i, "ok": False, "error": "id is also in delete"})
+            continue
+        try:
+            fields = build_fields(item, partial=True)
+        except Exception as e:
+            results.append({"op": "update", "index": i, "ok": False, "error": str(e)})
+            continue
+        for k, v in fields.items():
+            setattr(obj, k, v)
+        updated.append((i, obj))
+
+    for i, oid in enumerate(deletes):
+        obj = found.get(oid)
+        if obj is None:
+            results.append({"op": "delete", "index": i, "id": oid, "ok": False, "error": "not found"})
+            continue
+        db.session.delete(obj)
+        deleted_ids.append((i, oid))
+
+    db.session.add_all(obj for _, obj in created)
+    return results, created, updated, deleted_ids
+
+def _batch_response(results, created, updated, deleted_ids):
+    results += [{"op": "create", "index": i, "ok": True, "id": o.id, "item": o.to_json()} for i, o in created]
+    results += [{"op": "update", "index": i, "ok": True, "id": o.id, "item": o.to_json()} for i, o in updated]
+    results += [{"op": "delete", "index": i, "ok": True, "id": oid} for i, oid in deleted_ids]
+    results.sort(key=lambda r: (("create", "update", "delete").index(r["op"]), r["index"]))
+    return jsonify({
+        "created": len(created), "updated": len(updated), "deleted": len(deleted_ids),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "results": results
+    })
+
+def _batch_endpoint(model, build_fields, on_create=None, after_commit=None, touches=None):
+    data = request.get_json() or {}
+    n = sum(len(data.get(k) or []) for k in ('create', 'update', 'delete'))
+    if n > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"too many items ({n} > {BATCH_MAX_ITEMS})"}), 400
+    try:
+        out = _batch_apply(model, data, build_fields, on_create)
+        if touches and (out[1] or out[2] or out[3]):
+            bump_meta(touches)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    if after_commit:
+        after_commit(*out[1:])
+    return _batch_response(*out)
+
+def _asset_initial_tx(a: Asset, item: Dict):
+    if item.get('initial_transaction'):
+        apply_asset_tx(a, item['initial_transaction'])
+
+def _ledger_after_batch(created, updated, deleted_ids):
+    gone = {oid for _, oid in deleted_ids}
+    ledger_remove(gone)
+    ledger_upsert([o for _, o in created + updated if o.id not in gone])
+
+@bp.route('/api/assets/batch', methods=['POST'])
+def assets_batch():
+    """新建可带 initial_transaction: {type: 买入/卖出, amount}；更新可改 total_cost/current_value 等任意字段"""
+    return _batch_endpoint(Asset, asset_fields, on_create=_asset_initial_tx)
+
+@bp.route('/api/budget/entries/batch', methods=['POST'])
+def budget_entries_batch():
+    return _batch_endpoint(BudgetEntry, entry_fields, after_commit=_ledger_after_batch)
+
+@bp.route('/api/budget/rules/batch', methods=['POST'])
+def budget_rules_batch():
+    return _batch_endpoint(BudgetRule, rule_fields, touches="rules_version")
+
+# ---------------- 价格历史 & 风险参数 & 模拟 ----------------
+# 未给 mu/sigma、也没有历史数据时的按类型默认值（与前端原来的写死值一致）
+DEFAULT_RISK = {"股票": (0.08, 0.2), "基金": (0.06, 0.15)}
+SIM_MAX_CELLS = 10_000_000          # n_paths × 步数 × 资产数 上限（控制 CPU；内存由分块模拟限制）
+
+def held_symbols() -> List[str]:
+    rows = db.session.query(Asset.symbol).filter(Asset.symbol.isnot(None), Asset.symbol != '').distinct()
+    return sorted(r.symbol for r in rows)
+
+def load_price_series(symbols):
+    """{symbol: (日期序号数组, 收盘价数组)}，一次查询读出"""
+    import numpy as np
+
+    rows = (db.session.query(PriceHistory.symbol, PriceHistory.date, PriceHistory.close)
+            .filter(PriceHistory.symbol.in_(list(symbols)))
+            .order_by(PriceHistory.symbol, PriceHistory.date).all())
+    out = {}
+    for sym, grp in itertools.groupby(rows, key=lambda r: r.symbol):   # 已按 symbol 排序，一遍分组
+        d, c = zip(*((r.date.toordinal(), r.close) for r in grp))
+        out[sym] = (np.asarray(d, dtype=np.int64), np.asarray(c, dtype=float))
+    return out
+
+def get_risk_params(symbols, window: int):
+    import analytics
+    return analytics.risk_params(symbols, window, get_meta("history_version"), load_price_series)
+
+def _risk_json(est):
+    from datetime import date as _date
+    return {
+        "symbols": est["symbols"],
+        "start": _date.fromordinal(est["start"]).isoformat(),
+        "end": _date.fromordinal(est["end"]).isoformat(),
+        "observations": est["observations"],
+        "missing": est["missing"],
+        "mu": est["mu"].tolist(),
+        "annual_return": est["annual_return"].tolist(),
+        "sigma": est["sigma"].tolist(),
+        "max_drawdown": est["max_drawdown"].tolist(),
+        "cov": est["cov"].tolist(),
+        "corr": est["corr"].tolist(),
+    }
+
+@bp.route('/api/prices/history/refresh', methods=['POST'])
+def price_history_refresh():
+    """
+    请求体：{ "symbols": [...]（可选，默认=当前持仓里有代码的资产）, "range": "5y" }
+    从 Yahoo 拉日线写入本地 price_history（已有日期覆盖），返回每个代码写入的行数。
+    """
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+    from price_providers import yahoo_daily_history
+
+    data = request.get_json() or {}
+    symbols = [normalize_symbol(x) for x in (data.get('symbols') or held_symbols()) if x]
+    range_ = (data.get('range') or '5y').strip()
+    written = {}
+    for sym in symbols:
+        pts = yahoo_daily_history(sym, range_)
+        written[sym] = len(pts)
+        if not pts:
+            continue
+        stmt = sqlite_insert(PriceHistory.__table__)
+        stmt = stmt.on_conflict_do_update(index_elements=["symbol", "date"],
+                                          set_={"close": stmt.excluded.close})
+        db.session.execute(stmt, [{"symbol": sym, "date": datetime(d.year, d.month, d.day), "close": c}
+                                  for d, c in pts])
+    if any(written.values()):
+        bump_meta("history_version")
+    db.session.commit()
+    return jsonify({"written": written})
+
+@bp.get('/api/analytics/risk')
+def analytics_risk():
+    """
+    入参：?symbols=AAPL,510300.SH（可选，默认=当前持仓）&window=252（交易日）
+    出参：共同交易日上的年化收益/波动、协方差、相关系数、最大回撤；无足够历史时 404
+    """
+    raw = (request.args.get('symbols') or '').strip()
+    symbols = [normalize_symbol(x) for x in raw.split(',') if x.strip()] if raw else held_symbols()
+    try:
+        window = max(2, int(request.args.get('window') or 252))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    est = get_risk_params(symbols, window) if symbols else None
+    if est is None:
+        return jsonify({"error": "not enough local price history", "symbols": symbols}), 404
+    return jsonify(_risk_json(est))
+
+@bp.route('/api/simulate', methods=['POST'])
+def simulate():
+    """
+    请求体：{ "years": 5, "steps_per_year": 12, "n_paths": 2000, "start_value": (默认=当前总资产),
+             "assets": [{id, weight, mu, sigma}]（可选，默认按当前资产现值加权）,
+             "use_history": true, "window": 252, "seed": (可选) }
+    有本地日线的资产用历史估计的 mu/sigma 和相关系数（相关路径），其余用请求里的 mu/sigma 且视为独立。
+    出参：{ table: [{year, p5, p50, p95, mean}], assets: [...实际使用的参数], correlation }
+    """
+    import numpy as np
+    from analytics import simulate_paths
+
+    data = request.get_json() or {}
+    try:
+        years = max(1, int(data.get('years', 5)))
+        spy = max(1, int(data.get('steps_per_year', 12)))
+        n_paths = max(1, int(data.get('n_paths', 2000)))
+        start_value = float(data.get('start_value', compute_total_value()))
+        window = max(2, int(data.get('window', 252)))
+        seed = data.get('seed')
+        if seed is not None:
+            if isinstance(seed, bool) or (isinstance(seed, float) and not seed.is_integer()):
+                raise ValueError("seed must be a non-negative integer")
+            seed = int(seed)
+            if seed < 0:
+                raise ValueError("seed must be a non-negative integer")
+        items = []
+        for it in data.get('assets') or ():
+            if not isinstance(it, dict):
+                raise TypeError("each asset must be an object")
+            items.append({
+                "id": int(it['id']) if it.get('id') is not None else None,
+                "weight": max(0.0, float(it.get('weight') or 0.0)),
+                "mu": float(it['mu']) if it.get('mu') is not None else None,
+                "sigma": float(it['sigma']) if it.get('sigma') is not None else None,
+            })
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    assets_by_id = {a.id: a for a in Asset.query.all()}
+    if not items:
+        total = sum(max(0.0, float(a.current_value or 0.0)) for a in assets_by_id.values()) or 1.0
+        items = [{"id": a.id, "weight": max(0.0, float(a.current_value or 0.0)) / total, "mu": None, "sigma": None}
+                 for a in assets_by_id.values()]
+    if not items:
+        return jsonify({"table": [], "assets": [], "correlation": None})
+    if n_paths * years * spy * len(items) > SIM_MAX_CELLS:
+        return jsonify({"error": "simulation too large, reduce n_paths/years/assets"}), 400
+
+    params = []
+    for it in items:
+        a = assets_by_id.get(it['id'])
+        mu_d, sigma_d = DEFAULT_RISK.get(a.type if a else None, (0.03, 0.05))
+        if a is not None and a.asset_style == 'fixed':
+            mu_d, sigma_d = float(a.rate or 0.03), 0.01
+        params.append({
+            "id": it['id'],
+            "symbol": a.symbol if a is not None and a.asset_style != 'fixed' else None,
+            "weight": it['weight'],
+            "mu": it['mu'] if it['mu'] is not None else mu_d,
+            "sigma": it['sigma'] if it['sigma'] is not None else sigma_d,
+            "source": "input",
+        })
+
+    est = None
+    if data.get('use_history', True):
+        symbols = sorted({p["symbol"] for p in params if p["symbol"]})
+        est = get_risk_params(symbols, window) if symbols else None
+    col = {s: k for k, s in enumerate(est["symbols"])} if est else {}
+    for p in params:
+        k = col.get(p["symbol"])
+        if k is not None:
+            p.update(mu=float(est["mu"][k]), sigma=float(est["sigma"][k]), source="history")
+
+    n = len(params)
+    weights = np.array([p["weight"] for p in params])
+    weights = weights / weights.sum() if weights.sum() > 0 else np.full(n, 1.0 / n)
+    mu = np.array([p["mu"] for p in params])
+    cov = np.diag(np.array([p["sigma"] for p in params]) ** 2)
+    hist = [(i, col[p["symbol"]]) for i, p in enumerate(params) if p["source"] == "history"]
+    for i, ki in hist:
+        for j, kj in hist:
+            cov[i, j] = est["cov"][ki, kj]
+
+    finals = simulate_paths(weights, mu, cov, start_value, years, spy, n_paths, seed=seed)
+    pct = np.percentile(finals, [5, 50, 95], axis=0)
+    table = [{"year": y + 1, "p5": float(pct[0, y]), "p50": float(pct[1, y]),
+              "p95": float(pct[2, y]), "mean": float(finals[:, y].mean())} for y in range(years)]
+    return jsonify({
+        "table": table,
+        "assets": params,
+        "correlation": ({"symbols": est["symbols"], "matrix": est["corr"].tolist()} if est else None)
+    })
+
+# ---------------- 全文检索 ----------------
+SEARCH_KINDS = ("entries", "rules", "all")
+
+def _fts_hits(kind: str, match: str, typ: str, start, end):
+    """返回 (kind, id, score) 子查询；score 越小越相关（bm25）"""
+    if kind == "entries":
+        base, fts_name, tag = BudgetEntry.__table__, "budget_entries_fts", "entry"
+    else:
+        base, fts_name, tag = BudgetRule.__table__, "budget_rules_fts", "rule"
+    idx = table(fts_name, column("rowid"))
+    stmt = (select(literal(tag).label("kind"), base.c.id.label("id"),
+                   func.bm25(literal_column(fts_name)).label("score"))
+            .select_from(base.join(idx, idx.c.rowid == base.c.id))
+            .where(literal_column(fts_name).op("MATCH")(match)))
+    if typ:
+        stmt = stmt.where(base.c.type == typ)
+    if kind == "entries":
+        if start:
+            stmt = stmt.where(base.c.date >= start)
+        if end:
+            stmt = stmt.where(base.c.date < end + timedelta(days=1))
+    else:
+        # 规则按生效区间与 [start, end] 有交集过滤
+        if end:
+            stmt = stmt.where(base.c.start_date < end + timedelta(days=1))
+        if start:
+            stmt = stmt.where((base.c.end_date.is_(None)) | (base.c.end_date >= ym_to_dt(start.year, start.month)))
+    return stmt
+
+@bp.get('/api/budget/search')
+def budget_search():
+    """
+    入参：?q=关键词&kind=entries|rules|all&type=收入|支出&start=YYYY-MM-DD&end=YYYY-MM-DD&page=1&limit=20
+    q 里空白分隔的词同时命中；英文词末尾加 * 为前缀匹配；中文任意连续字串都可命中。
+    出参：{total, page, limit, hits: [{kind, score, item}]}，按相关度排序
+    """
+    match = fts.build_match(request.args.get('q') or '')
+    kind = (request.args.get('kind') or 'entries').strip()
+    if kind not in SEARCH_KINDS:
+        return jsonify({"error": f"kind must be one of {', '.join(SEARCH_KINDS)}"}), 400
+    try:
+        page = max(1, int(request.args.get('page') or 1))
+        limit = max(1, min(int(request.args.get('limit') or 20), 200))
+        start_s = (request.args.get('start') or '').strip()
+        end_s = (request.args.get('end') or '').strip()
+        start = parse_date(start_s) if start_s else None
+        end = parse_date(end_s) if end_s else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not match:
+        return jsonify({"total": 0, "page": page, "limit": limit, "hits": []})
+    typ = (request.args.get('type') or '').strip() or None
+
+    kinds = ("entries", "rules") if kind == "all" else (kind,)
+    parts = [_fts_hits(k, match, typ, start, end) for k in kinds]
+    hits = parts[0].union_all(*parts[1:]).subquery() if len(parts) > 1 else parts[0].subquery()
+    try:
+        total = db.session.execute(select(func.count()).select_from(hits)).scalar()
+        rows = db.session.execute(
+            select(hits).order_by(hits.c.score, hits.c.id).limit(limit).offset((page - 1) * limit)
+        ).all()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": f"search failed: {e}"}), 400
+
+    models = {"entry": BudgetEntry, "rule": BudgetRule}
+    objs = {}
+    for tag, model in models.items():
+        ids = [r.id for r in rows if r.kind == tag]
+        if ids:
+            objs.update({(tag, o.id): o for o in model.query.filter(model.id.in_(ids)).all()})
+    return jsonify({
+        "total": total, "page": page, "limit": limit,
+        "hits": [{"kind": r.kind, "score": r.score, "item": objs[(r.kind, r.id)].to_json()}
+                 for r in rows if (r.kind, r.id) in objs]
+    })
+
+# ---------------- 导出 ----------------
+# 表名 -> (模型, 日期过滤列)；资产交易目前只累计进 total_cost，没有单独落表，故无交易明细可导
+EXPORT_TABLES = {
+    "budget_entries": (BudgetEntry, "date"),
+    "snapshots": (Snapshot, "created_at"),
+    "assets": (Asset, "start_date"),
+}
+
+@bp.get('/api/export/<name>')
+def export_table(name):
+    """
+    入参：?format=csv|parquet|arrow&start=YYYY-MM-DD&end=YYYY-MM-DD（日期闭区间，可选）
+    按主键分块查询、边读边写，导出百万行也不会把整表读进内存，块与块之间不占库锁。
+    """
+    import exporter
+
+    if name not in EXPORT_TABLES:
+        return jsonify({"error": f"unknown table, choose from {', '.join(EXPORT_TABLES)}"}), 404
+    fmt = (request.args.get('format') or 'csv').strip().lower()
+    if fmt not in exporter.EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(exporter.EXPORT_FORMATS)}"}), 400
+    if fmt != 'csv' and not exporter.have_pyarrow():
+        return jsonify({"error": f"{fmt} export requires pyarrow"}), 400
+
+    model, date_col = EXPORT_TABLES[name]
+    table = model.__table__
+    where = []
+    try:
+        start_s = (request.args.get('start') or '').strip()
+        end_s = (request.args.get('end') or '').strip()
+        if start_s:
+            where.append(table.c[date_col] >= parse_date(start_s))
+        if end_s:
+            where.append(table.c[date_col] < parse_date(end_s) + timedelta(days=1))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    chunks = exporter.iter_chunks(db.session, table, where)
+    if fmt == 'csv':
+        body = exporter.stream_csv(chunks, [c.name for c in table.columns])
+    else:
+        body = exporter.stream_arrow(chunks, table, fmt)
+    mimetype, ext = exporter.EXPORT_FORMATS[fmt]
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{name}.{ext}"'})
+
+# ---------------- 增量同步 ----------------
+# 变更日志定期压缩：同一行只保留最新一条；超过保留期的整体删掉并抬高下限游标
+CHANGELOG_RETENTION_DAYS = int(os.getenv("CHANGELOG_RETENTION_DAYS", "30"))
+CHANGELOG_COMPACT_INTERVAL = 3600          # 秒；所有 worker 合计最多这么久压缩一次
+CHANGELOG_COMPACT_CHECK = 300              # 秒；每个进程最多这么久去 app_meta 看一次是否到期
+CHANGES_PAGE_SIZE = 5000
+# 上次压缩时间存在 app_meta（跨 worker 共享、重启不丢），进程内只记上次检查时间
+_last_compact = {"checked": 0.0, "running": False}
+_compact_lock = threading.Lock()
+
+def compact_changes() -> None:
+    log = ChangeLog.__table__
+    newest = db.session.query(func.max(ChangeLog.id)).group_by(ChangeLog.table_name, ChangeLog.row_id)
+    db.session.execute(log.delete().where(log.c.id.not_in(newest.scalar_subquery())))
+    cutoff = datetime.utcnow() - timedelta(days=CHANGELOG_RETENTION_DAYS)
+    # 最新一条永远保留：旧库里的 change_log 没有 AUTOINCREMENT，删空后 id 会回到 1
+    head = db.session.query(func.max(ChangeLog.id)).scalar()
+    floor = (db.session.query(func.max(ChangeLog.id))
+             .filter(ChangeLog.created_at < cutoff, ChangeLog.id < head).scalar()) if head else None
+    if floor:
+        db.session.execute(log.delete().where(log.c.id <= floor))
+        row = db.session.get(AppMeta, "changelog_floor")
+        if row is None:
+            db.session.add(AppMeta(key="changelog_floor", value=floor))
+        else:
+            row.value = max(int(row.value), floor)
+    db.session.commit()
+
+def _compact_if_due() -> None:
+    """按 app_meta 里的上次压缩时间判断是否到期；用条件 UPDATE 抢占，多个 worker 只有一个会压缩"""
+    now = int(time.time())
+    row = db.session.get(AppMeta, "changelog_compacted_at")
+    if row is None:
+        # 新库：从现在起计时
+        db.session.add(AppMeta(key="changelog_compacted_at", value=now))
+        db.session.commit()
+        return
+    last = int(row.value)
+    if now - last <= CHANGELOG_COMPACT_INTERVAL:
+        db.session.rollback()
+        return
+    meta = AppMeta.__table__
+    claimed = db.session.execute(
+        meta.update().where(meta.c.key == "changelog_compacted_at", meta.c.value == last).values(value=now)
+    ).rowcount
+    if claimed != 1:
+        db.session.rollback()
+        return
+    compact_changes()              # 与时间戳同一事务提交，压缩失败则时间戳一并回滚
+
+def _compact_in_background(app) -> None:
+    with app.app_context():
+        try:
+            _compact_if_due()
+        except Exception as e:
+            db.session.rollback()
+            print("[changes] compact error:", e)
+        finally:
+            _last_compact["running"] = False
+
+@bp.after_request
+def maybe_compact_changes(response):
+    """写请求后按间隔检查是否该压缩；检查和压缩都在后台线程里跑，不占用当前请求"""
+    if request.method not in ("POST", "PUT", "DELETE"):
+        return response
+    with _compact_lock:
+        if _last_compact["running"] or time.time() - _last_compact["checked"] <= CHANGELOG_COMPACT_CHECK:
+            return response
+        _last_compact["checked"] = time.time()
+        _last_compact["running"] = True
+    threading.Thread(target=_compact_in_background, args=(current_app._get_current_object(),),
+                     name="changelog-compact", daemon=True).start()
+    return response
+
+@bp.get('/api/changes')
+def changes_feed():
+    """
+    入参：?since=<游标>&limit=5000（首次同步：先全量拉取各列表，再从 since=0 开始增量，重复的行按覆盖处理）
+    出参：{cursor, has_more, reset, changes: {表名: {inserted: [行], updated: [行], deleted: [id]}}}
+    - 同一行在区间内多次变更只按最终状态返回一次；updated 按“存在则覆盖、不存在则插入”处理
+    - reset=true 表示 since 早于已压缩掉的日志，客户端需全量重拉各列表后改用返回的 cursor
+    """
+    try:
+        since = int(request.args.get('since') or 0)
+        limit = max(1, min(int(request.args.get('limit') or CHANGES_PAGE_SIZE), CHANGES_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if since < get_meta("changelog_floor"):
+        head = db.session.query(func.coalesce(func.max(ChangeLog.id), 0)).scalar()
+        head = max(int(head), get_meta("changelog_floor"))
+        return jsonify({"cursor": head, "has_more": False, "reset": True, "changes": {}})
+
+    logs = (ChangeLog.query.filter(ChangeLog.id > since)
+            .order_by(ChangeLog.id.asc()).limit(limit + 1).all())
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+
+    # (表, 行) -> [首个操作, 最后操作]
+    ops = {}
+    for c in logs:
+        key = (c.table_name, c.row_id)
+        if key in ops:
+            ops[key][1] = c.op
+        else:
+            ops[key] = [c.op, c.op]
+
+    changes = {}
+    for name, model in CHANGE_TRACKED.items():
+        keys = {rid: o for (t, rid), o in ops.items() if t == name}
+        if not keys:
+            continue
+        live = [rid for rid, (first, last) in keys.items() if last != "delete"]
+        rows = {r.id: r for r in model.query.filter(model.id.in_(live)).all()} if live else {}
+        bucket = {"inserted": [], "updated": [], "deleted": []}
+        for rid, (first, last) in sorted(keys.items()):
+            if last == "delete":
+                if first != "insert":          # 区间内新建又删除的，客户端从没见过，直接略过
+                    bucket["deleted"].append(rid)
+            elif rid in rows:
+                bucket["inserted" if first == "insert" else "updated"].append(rows[rid].to_json())
+        changes[name] = bucket
+
+    return jsonify({
+        "cursor": logs[-1].id if logs else since,
+        "has_more": has_more,
+        "reset": False,
+        "changes": changes
+    })
+
 # ---------------- 市场搜索/行情 ----------------
-@app.get("/api/search")
+@bp.get("/api/search")
 def market_search():
     """
     入参：?q=关键词/中文/6位代码
@@ -427,6 +1190,7 @@ def market_search():
     q = (request.args.get('q') or '').strip()
     if not q:
         return jsonify([])
+    from price_providers import alpha_search   # 首次搜索时才加载行情模块
     try:
         cands = alpha_search(q) or []
         # 为了保险，裁剪一下字段顺序/空值
@@ -445,78 +1209,202 @@ def market_search():
         print("search error:", e)
         return jsonify([])
 
-@app.route('/api/quote', methods=['GET'])
+# mode=cached 时，最后已知价格超过这么多秒才触发后台刷新
+QUOTE_REFRESH_AFTER = 60.0
+
+def _last_known(hit, refreshing: bool = False, fallback: bool = False):
+    """
+    store.get() 的结果 -> 带时效标记的报价 JSON。
+    fallback=True 表示实时抓取失败、退回最后已知价格：无论多新都标 stale。
+    """
+    if hit is None:
+        return None
+    payload, age = hit
+    return {**payload, "stale": fallback or age > QUOTE_REFRESH_AFTER, "fallback": fallback,
+            "age_seconds": age, "refreshing": refreshing}
+
+@bp.route('/api/quote', methods=['GET'])
 def get_quote():
+    """
+    入参：?symbol=AAPL&mode=live|cached
+    - live（默认）：实时抓取；上游全部失败时退回最后已知价格（stale=true, fallback=true, age_seconds=距上次成功的秒数）
+    - cached：有最后已知价格就立即返回（超过 QUOTE_REFRESH_AFTER 秒标 stale 并后台异步刷新）；没有记录时按 live 处理
+    """
     symbol = (request.args.get('symbol') or '').strip()
     if not symbol:
         return jsonify({"error": "symbol is required"}), 400
+    from price_providers import smart_quote    # 首次报价时才加载行情模块
+    from quote_store import get_store
+    store = get_store()
+    mode = (request.args.get('mode') or 'live').strip().lower()
+
+    if mode == 'cached':
+        hit = store.get(symbol)
+        if hit is not None:
+            refreshing = hit[1] > QUOTE_REFRESH_AFTER
+            if refreshing:
+                store.refresh_async(symbol, smart_quote)
+            return jsonify(_last_known(hit, refreshing)), 200
+
     try:
-        q = smart_quote(symbol)
+        q = store.fetch(symbol, smart_quote)
         print('[quote]', symbol, q.to_json() if q else None)  # 调试日志
-        if not q or q.price is None:           # ← 没拿到价就返回 404
+        if not q or q.price is None:           # ← 没拿到价：先退回最后已知价格，再没有才 404
+            stale = _last_known(store.get(symbol), fallback=True)
+            if stale is not None:
+                return jsonify(stale), 200
             return jsonify({"error": "no quote"}), 404
-        return jsonify(q.to_json()), 200       # ← 返回完整对象，别只返回 price/symbol
+        return jsonify({**q.to_json(), "stale": False, "fallback": False, "age_seconds": 0.0}), 200
     except Exception as e:
         print('[quote] error:', e)
+        stale = _last_known(store.get(symbol), fallback=True)
+        if stale is not None:
+            return jsonify(stale), 200
         return jsonify({"error": str(e)}), 500
     
 # ---------------- 财务规划曲线 ----------------
-@app.route('/api/plan/curve', methods=['POST'])
+@bp.route('/api/plan/curve', methods=['POST'])
 def plan_curve():
     """
     请求体：{ "years": 30, "annual_return": 0.06, "start_value": (可选，默认=当前总资产) }
     月化收益 = (1+annual_return)**(1/12) - 1
     财富_{t+1} = 财富_t * (1+月化收益) + 当月净现金流(来自规则：收入-支出)
     """
+    from planning import month_labels, wealth_grid
+
     data = request.get_json() or {}
     years = int(data.get("years", 30))
     annual_return = float(data.get("annual_return", 0.06))
     start_value = float(data.get("start_value", compute_total_value()))
     months = max(1, years * 12)
-    r_m = pow(1.0 + annual_return, 1.0/12.0) - 1.0
 
     now = datetime.utcnow()
-    y, m = now.year, now.month
-
-    wealth = start_value
-    points = []
-
-    for _ in range(months):
-        month_income = 0.0
-        month_expense = 0.0
-        for r in BudgetRule.query.all():
-            if in_month_window(r, y, m):
-                amt = amount_at_month(r, y, m)
-                if r.type == '收入':
-                    month_income += amt
-                else:
-                    month_expense += amt
-        net = month_income - month_expense
-        wealth = wealth * (1.0 + r_m) + net
-
-        points.append({
-            "month": f"{y:04d}-{m:02d}",
-            "income": month_income,
-            "expense": month_expense,
-            "net": net,
-            "wealth": wealth
-        })
-
-        if m == 12:
-            y, m = y + 1, 1
-        else:
-            m += 1
+    income, expense = plan_cashflows(now.year, now.month, months)
+    net = income - expense
+    wealth = wealth_grid(net, [annual_return], [start_value])[0, 0, 0, 0]
 
+    points = [
+        {"month": label, "income": inc, "expense": exp, "net": n, "wealth": w}
+        for label, inc, exp, n, w in zip(
+            month_labels(now.year, now.month, months),
+            income.tolist(), expense.tolist(), net.tolist(), wealth.tolist())
+    ]
     return jsonify({
         "params": {"years": years, "annual_return": annual_return, "start_value": start_value},
         "points": points
     })
 
-# ---------------- 启动前建表 ----------------
-with app.app_context():
-    db.create_all()
+# 单次网格请求的规模上限：情景数 × 采样点数，以及收益率个数 × 月数
+PLAN_GRID_MAX_CELLS = 2_000_000
+
+def _float_list(v, default):
+    if v is None:
+        return list(default)
+    if not isinstance(v, (list, tuple)):
+        v = [v]
+    return [float(x) for x in v]
+
+@bp.route('/api/plan/grid', methods=['POST'])
+def plan_grid():
+    """
+    多情景批量计算（一次请求代替逐个调用 /api/plan/curve）。
+    请求体：{
+      "years": 30,
+      "annual_returns": [0.02, 0.04, ...],
+      "start_values": [...]         (可选，默认=[当前总资产]),
+      "extra_monthly": [0, 2000]    (可选，每月额外储蓄),
+      "inflation": [0, 0.02]        (可选，年通胀，用于折算实际财富),
+      "step": 12                    (可选，采样间隔月数，默认每年一个点)
+    }
+    返回：months 为采样月份；scenarios 为各参数组合的财富曲线（wealth 与 months 一一对应）。
+    """
+    from planning import month_labels, sample_indices, wealth_grid
+
+    data = request.get_json() or {}
+    try:
+        years = int(data.get("years", 30))
+        returns = _float_list(data.get("annual_returns"), [0.06])
+        starts = _float_list(data.get("start_values"), [compute_total_value()])
+        extras = _float_list(data.get("extra_monthly"), [0.0])
+        inflations = _float_list(data.get("inflation"), [0.0])
+        step = int(data.get("step", 12))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if not (returns and starts and extras and inflations):
+        return jsonify({"error": "empty parameter vector"}), 400
+
+    months = max(1, years * 12)
+    idx = sample_indices(months, step)
+    n_scen = len(returns) * len(starts) * len(extras) * len(inflations)
+    if n_scen * len(idx) > PLAN_GRID_MAX_CELLS or len(returns) * months > PLAN_GRID_MAX_CELLS:
+        return jsonify({"error": "grid too large, reduce vectors or increase step"}), 400
+
+    now = datetime.utcnow()
+    income, expense = plan_cashflows(now.year, now.month, months)
+    grid = wealth_grid(income - expense, returns, starts, extras, inflations, idx=idx)
+
+    labels = month_labels(now.year, now.month, months)
+    flat = grid.reshape(n_scen, len(idx)).tolist()
+    combos = itertools.product(returns, starts, extras, inflations)
+    scenarios = [
+        {"annual_return": r, "start_value": s0, "extra_monthly": e, "inflation": i,
+         "wealth": w, "final": w[-1]}
+        for (r, s0, e, i), w in zip(combos, flat)
+    ]
+    return jsonify({
+        "params": {"years": years, "step": step, "annual_returns": returns, "start_values": starts,
+                   "extra_monthly": extras, "inflation": inflations},
+        "months": [labels[k] for k in idx],
+        "scenarios": scenarios
+    })
+
+PLAN_SOLVE_TARGETS = ("annual_return", "extra_monthly", "start_value")
+
+@bp.route('/api/plan/solve', methods=['POST'])
+def plan_solve():
+    """
+    目标反推：多少年后想要达到 target，需要多少年化收益 / 每月额外储蓄 / 起始资产？
+    请求体：{
+      "target": 5000000, "years": 20,
+      "solve_for": "annual_return" | "extra_monthly" | "start_value",
+      "annual_return": 0.06, "start_value": (默认=当前总资产), "extra_monthly": 0   (非求解项作为已知条件)
+      "bounds": [-0.99, 1.0]   (可选，仅求收益率时使用)
+    }
+    现金流沿用规则（与 /api/plan/curve 同口径）。
+    """
+    from planning import solve_plan
+
+    data = request.get_json() or {}
+    solve_for = data.get("solve_for") or "annual_return"
+    if solve_for not in PLAN_SOLVE_TARGETS:
+        return jsonify({"error": f"solve_for must be one of {', '.join(PLAN_SOLVE_TARGETS)}"}), 400
+    try:
+        target = float(data["target"])
+        years = int(data.get("years", 30))
+        annual_return = float(data.get("annual_return", 0.06))
+        start_value = float(data.get("start_value", compute_total_value()))
+        extra_monthly = float(data.get("extra_monthly", 0.0))
+        lo, hi = (float(x) for x in (data.get("bounds") or (-0.99, 1.0)))
+    except KeyError:
+        return jsonify({"error": "target is required"}), 400
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if years <= 0 or lo >= hi:
+        return jsonify({"error": "years must be positive and bounds ascending"}), 400
+
+    months = years * 12
+    now = datetime.utcnow()
+    income, expense = plan_cashflows(now.year, now.month, months)
+    result = solve_plan(income - expense, target, solve_for, annual_return=annual_return,
+                        start_value=start_value, extra_monthly=extra_monthly, bounds=(lo, hi))
+    params = {"target": target, "years": years, "solve_for": solve_for, "annual_return": annual_return,
+              "start_value": start_value, "extra_monthly": extra_monthly}
+    params.pop(solve_for)
+    if result["value"] is None:
+        return jsonify({"error": "target unreachable within bounds", "params": params, **result}), 422
+    return jsonify({"params": params, **result})
 
 if __name__ == "__main__":
     # 本地默认 5001；部署到 Render/Fly 等平台可用 PORT 环境变量
     port = int(os.getenv("PORT", "5001"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    create_app().run(host="0.0.0.0", port=port, debug=True)
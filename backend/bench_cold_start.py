@@ -0,0 +1,73 @@
+# bench_cold_start.py — 冷启动基准：import 耗时 + 首个 /health + 首个 /api/assets
+# 用法：python bench_cold_start.py [--runs 5] [--budget-ms 1500]
+# 每轮都起一个全新的解释器（模拟实例休眠后被唤醒），数据库用临时文件，不动 data.sqlite。
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+
+# 子进程里执行的测量脚本，结果以一行 JSON 打到 stdout
+_PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+app = create_app()
+client = app.test_client()
+t2 = time.perf_counter()
+r1 = client.get("/health")
+t3 = time.perf_counter()
+r2 = client.get("/api/assets")
+t4 = time.perf_counter()
+assert r1.status_code == 200 and r2.status_code == 200, (r1.status_code, r2.status_code)
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "create_app_ms": (t2 - t1) * 1000,
+    "first_health_ms": (t3 - t2) * 1000,
+    "first_assets_ms": (t4 - t3) * 1000,
+    "total_ms": (t4 - t0) * 1000,
+}))
+"""
+
+
+def run_once(db_file: str) -> dict:
+    env = dict(os.environ, SQLITE_PATH=db_file, PYTHONDONTWRITEBYTECODE="1")
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=HERE, env=env,
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="冷启动基准")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--budget-ms", type=float, default=None,
+                    help="total_ms 中位数超过该值时返回非 0，方便在 CI 里卡回归")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "bench.sqlite")
+        # 第 1 轮是全新库（含建表），之后几轮是已建表的“唤醒”场景
+        runs = [run_once(db_file) for _ in range(max(1, args.runs))]
+
+    first, warm = runs[0], runs[1:] or runs
+    keys = list(first.keys())
+    print(f"{'metric':<18}{'fresh db':>12}{'median(warm)':>16}")
+    for k in keys:
+        print(f"{k:<18}{first[k]:>12.1f}{statistics.median(r[k] for r in warm):>16.1f}")
+
+    if args.budget_ms is not None:
+        med = statistics.median(r["total_ms"] for r in warm)
+        if med > args.budget_ms:
+            print(f"冷启动回归：total_ms 中位数 {med:.1f} > {args.budget_ms:.1f}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
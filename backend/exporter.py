@@ -0,0 +1,135 @@
+# exporter.py — 流式导出：按主键分块查询，边读边写 CSV / Parquet / Arrow，内存占用恒定
+# Parquet / Arrow 依赖 pyarrow（可选），未安装时只支持 CSV。
+import csv
+import io
+from datetime import date, datetime
+
+from sqlalchemy import DateTime, Float, Integer, select
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+CHUNK_ROWS = 5000
+
+
+def have_pyarrow() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def iter_chunks(session, table, where=(), chunk_rows: int = CHUNK_ROWS):
+    """
+    按主键顺序分块读取，每块是一组 Row（不构造 ORM 对象）。
+    每块单独一条 id > 上一块末尾 的短查询，取完即结束读事务：
+    客户端下载再慢，两块之间也不持有库锁，不挡其它连接写入。
+    """
+    last = None
+    while True:
+        stmt = select(table).where(*where).order_by(table.c.id).limit(chunk_rows)
+        if last is not None:
+            stmt = stmt.where(table.c.id > last)
+        rows = session.execute(stmt).all()
+        session.rollback()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_rows:
+            return
+        last = rows[-1].id
+
+
+def _cell(v):
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ")
+    if isinstance(v, date):
+        return v.isoformat()
+    return "" if v is None else v
+
+
+def stream_csv(chunks, columns):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(columns)
+    for rows in chunks:
+        w.writerows([_cell(v) for v in row] for row in rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+    tail = buf.getvalue()
+    if tail:
+        yield tail.encode("utf-8")
+
+
+class _ChunkSink:
+    """给 pyarrow 写的只追加缓冲区：写一批取走一批，不在内存里攒整份文件"""
+
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        out = b"".join(self.parts)
+        self.parts = []
+        return out
+
+
+def arrow_schema(table):
+    import pyarrow as pa
+
+    def arrow_type(col):
+        if isinstance(col.type, Integer):
+            return pa.int64()
+        if isinstance(col.type, Float):
+            return pa.float64()
+        if isinstance(col.type, DateTime):
+            return pa.timestamp("us")
+        return pa.string()
+
+    return pa.schema([pa.field(c.name, arrow_type(c)) for c in table.columns])
+
+
+def stream_arrow(chunks, table, fmt: str):
+    """fmt = parquet（每块一个 row group）或 arrow（IPC stream，每块一个 record batch）"""
+    import pyarrow as pa
+
+    schema = arrow_schema(table)
+    names = schema.names
+    sink = _ChunkSink()
+    out = pa.PythonFile(sink, mode="w")
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(out, schema)
+    else:
+        writer = pa.ipc.new_stream(out, schema)
+    try:
+        for rows in chunks:
+            cols = list(zip(*rows)) if rows else [[] for _ in names]
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(list(c), type=f.type) for c, f in zip(cols, schema)], schema=schema)
+            if fmt == "parquet":
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    data = sink.drain()
+    if data:
+        yield data
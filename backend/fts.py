@@ -0,0 +1,114 @@
+# fts.py — 收支明细 / 预算规则的全文检索（SQLite FTS5）
+# 中文没有空格分词，unicode61 会把整句当成一个词；这里写入前把每个 CJK 字符拆成单字 token，
+# 查询时把中文词变成相邻单字的短语（"工 资"），既支持任意中文子串，也不依赖外部分词库。
+# 拆字在 Python 里做，索引由 Session 的 after_flush 钩子同步（与 change_log 同一事务）；
+# 原表上不挂触发器，用 sqlite3 命令行等外部工具改库不会因缺少自定义函数而失败，
+# 但外部改动不会进索引；需要时删掉索引表、把 user_version 置 0，重启后会全量回填。
+import re
+
+_CJK = re.compile(r"([぀-ヿ㐀-䶿一-鿿가-힯豈-﫿])")
+
+# 索引表：(FTS 表名, 原表名, 索引列)
+FTS_TABLES = (
+    ("budget_entries_fts", "budget_entries", ("category", "note")),
+    ("budget_rules_fts", "budget_rules", ("category", "note")),
+)
+
+
+def cjk_segment(s):
+    if not s:
+        return ""
+    return _CJK.sub(r" \1 ", s)
+
+
+def _ddl(fts: str, base: str, cols):
+    col_list = ", ".join(cols)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({col_list}, tokenize='unicode61 remove_diacritics 2')",
+        # 旧版本在原表上建过依赖 fts_cjk() 的触发器，升级时去掉
+        f"DROP TRIGGER IF EXISTS {fts}_ai",
+        f"DROP TRIGGER IF EXISTS {fts}_ad",
+        f"DROP TRIGGER IF EXISTS {fts}_au",
+    ]
+
+
+# 各库的索引表是否存在：库 URL -> bool（SQLite 未编译 FTS5 时为 False，同步直接跳过）
+_ready = {}
+
+
+def _available(conn) -> bool:
+    from sqlalchemy import bindparam, text
+
+    key = str(conn.engine.url)
+    if key not in _ready:
+        names = [fts for fts, _, _ in FTS_TABLES]
+        stmt = text("SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN :names")
+        found = conn.execute(stmt.bindparams(bindparam("names", expanding=True)), {"names": names}).scalar()
+        _ready[key] = found == len(names)
+    return _ready[key]
+
+
+def install(conn) -> None:
+    """建 FTS 表；索引表是新建的就从原表回填一次。conn 为 SQLAlchemy Connection"""
+    from sqlalchemy import text
+
+    for fts, base, cols in FTS_TABLES:
+        existed = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :n"), {"n": fts}
+        ).first()
+        for stmt in _ddl(fts, base, cols):
+            conn.execute(text(stmt))
+        if not existed:
+            rows = conn.execute(text(f"SELECT id, {', '.join(cols)} FROM {base}")).all()
+            _insert(conn, fts, cols, [tuple(r) for r in rows])
+    _ready[str(conn.engine.url)] = True
+
+
+def _insert(conn, fts: str, cols, rows) -> None:
+    """rows: [(id, 列值...)]，按列拆字后写入索引"""
+    if not rows:
+        return
+    from sqlalchemy import text
+
+    col_list = ", ".join(cols)
+    params = ", ".join(f":c{i}" for i in range(len(cols)))
+    conn.execute(
+        text(f"INSERT INTO {fts}(rowid, {col_list}) VALUES (:id, {params})"),
+        [{"id": r[0], **{f"c{i}": cjk_segment(v) for i, v in enumerate(r[1:])}} for r in rows],
+    )
+
+
+def sync(conn, changes) -> None:
+    """
+    changes: {原表名: (要移除的 id 集合, [(id, 列值...)] 要（重新）写入的行)}
+    先删后插，更新即“删旧插新”。conn 为 SQLAlchemy Connection。
+    """
+    if not changes or not _available(conn):
+        return
+    from sqlalchemy import text
+
+    for fts, base, cols in FTS_TABLES:
+        removed, rows = changes.get(base, ((), ()))
+        ids = set(removed) | {r[0] for r in rows}
+        if ids:
+            conn.execute(text(f"DELETE FROM {fts} WHERE rowid = :id"), [{"id": i} for i in ids])
+        _insert(conn, fts, cols, rows)
+
+
+def build_match(q: str):
+    """
+    用户输入 -> FTS5 MATCH 表达式；空白分隔的词之间是 AND。
+    英文/数字词末尾带 * 为前缀匹配（如 sal*）；中文词按相邻单字短语匹配。
+    无有效词时返回 None。
+    """
+    terms = []
+    for raw in (q or "").split():
+        prefix = raw.endswith("*")
+        word = raw.rstrip("*")
+        tokens = cjk_segment(word).split()
+        tokens = [t.replace('"', '""') for t in tokens if t.strip('"')]
+        if not tokens:
+            continue
+        phrase = '"' + " ".join(tokens) + '"'
+        terms.append(phrase + ("*" if prefix else ""))
+    return " ".join(terms) if terms else None
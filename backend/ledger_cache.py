@@ -0,0 +1,150 @@
+# ledger_cache.py — 收支明细的进程内列式缓存（可选，LEDGER_CACHE=1 开启）
+# 日期序号 int32 / 金额 float64 / 类型、类别字典编码为小整数；每种类型一条前缀和，
+# 任意日期区间的合计 = 两次二分查找 + 一次减法。
+# 注意：缓存是每个进程一份，只感知本进程的写入，适合单 worker 部署。
+import threading
+from datetime import date, datetime
+
+import numpy as np
+
+
+def _ordinal(d) -> int:
+    if isinstance(d, datetime):
+        d = d.date()
+    return d.toordinal()
+
+
+class _Dictionary:
+    """字符串 <-> 小整数编码，只增不删"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, v: str) -> int:
+        code = self.codes.get(v)
+        if code is None:
+            code = len(self.values)
+            self.values.append(v)
+            self.codes[v] = code
+        return code
+
+
+class LedgerCache:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.types = _Dictionary()
+        self.categories = _Dictionary()
+        self._reset()
+
+    def _reset(self):
+        # 按 (日期, id) 升序排列
+        self.ids = np.empty(0, dtype=np.int64)
+        self.dates = np.empty(0, dtype=np.int32)
+        self.amounts = np.empty(0, dtype=np.float64)
+        self.type_codes = np.empty(0, dtype=np.int32)
+        self.category_codes = np.empty(0, dtype=np.int32)
+        self.notes = []
+        self._prefix = {}
+
+    def __len__(self):
+        return int(self.ids.shape[0])
+
+    # ---------- 构建 / 增量维护 ----------
+    def _columns(self, rows):
+        n = len(rows)
+        return (
+            np.fromiter((r[0] for r in rows), dtype=np.int64, count=n),
+            np.fromiter((_ordinal(r[1]) for r in rows), dtype=np.int32, count=n),
+            np.fromiter((float(r[4]) for r in rows), dtype=np.float64, count=n),
+            np.fromiter((self.types.encode(r[2]) for r in rows), dtype=np.int32, count=n),
+            np.fromiter((self.categories.encode(r[3]) for r in rows), dtype=np.int32, count=n),
+            [r[5] for r in rows],
+        )
+
+    def _merge(self, keep, rows):
+        """保留 keep 掩码选中的旧行，并入新行，整体排序一次、前缀和重算一次"""
+        ids, dates, amounts, types, cats, notes = self._columns(rows)
+        ids = np.concatenate((self.ids[keep], ids))
+        dates = np.concatenate((self.dates[keep], dates))
+        order = np.lexsort((ids, dates))
+        self.ids = ids[order]
+        self.dates = dates[order]
+        self.amounts = np.concatenate((self.amounts[keep], amounts))[order]
+        self.type_codes = np.concatenate((self.type_codes[keep], types))[order]
+        self.category_codes = np.concatenate((self.category_codes[keep], cats))[order]
+        old_notes = [n for n, k in zip(self.notes, keep) if k]
+        all_notes = old_notes + notes
+        self.notes = [all_notes[i] for i in order]
+        self._refresh_prefix()
+
+    def rebuild(self, rows):
+        """rows: 可迭代的 (id, date, type, category, amount, note)"""
+        rows = list(rows)
+        with self._lock:
+            self._reset()
+            self._merge(np.zeros(0, dtype=bool), rows)
+
+    def _refresh_prefix(self):
+        self._prefix = {
+            code: np.concatenate(([0.0], np.cumsum(np.where(self.type_codes == code, self.amounts, 0.0))))
+            for code in range(len(self.types.values))
+        }
+
+    def upsert_many(self, rows):
+        """批量新增/覆盖：rows 同 rebuild；同一 id 以最后一条为准"""
+        rows = list({r[0]: r for r in rows}.values())
+        if not rows:
+            return
+        with self._lock:
+            keep = ~np.isin(self.ids, [r[0] for r in rows])
+            self._merge(keep, rows)
+
+    def remove_many(self, entry_ids):
+        entry_ids = list(entry_ids)
+        if not entry_ids:
+            return
+        with self._lock:
+            keep = ~np.isin(self.ids, entry_ids)
+            if keep.all():
+                return
+            self._merge(keep, [])
+
+    def upsert(self, entry_id, d, typ, category, amount, note):
+        self.upsert_many([(entry_id, d, typ, category, amount, note)])
+
+    def remove(self, entry_id):
+        self.remove_many([entry_id])
+
+    # ---------- 查询 ----------
+    def _bounds(self, start: date = None, end: date = None):
+        """闭区间 [start, end] 对应的行号范围 [lo, hi)"""
+        lo = int(np.searchsorted(self.dates, _ordinal(start), side="left")) if start else 0
+        hi = int(np.searchsorted(self.dates, _ordinal(end), side="right")) if end else len(self)
+        return lo, max(lo, hi)
+
+    def totals(self, start: date = None, end: date = None):
+        """{类型: 区间合计}"""
+        with self._lock:
+            lo, hi = self._bounds(start, end)
+            return {
+                self.types.values[code]: float(cum[hi] - cum[lo])
+                for code, cum in self._prefix.items()
+            }
+
+    def rows(self, start: date = None, end: date = None):
+        """区间内明细，格式同 BudgetEntry.to_json，按 (日期, id) 升序"""
+        with self._lock:
+            lo, hi = self._bounds(start, end)
+            types, cats = self.types.values, self.categories.values
+            return [
+                {
+                    "id": int(self.ids[i]),
+                    "date": date.fromordinal(int(self.dates[i])).strftime("%Y-%m-%d"),
+                    "type": types[self.type_codes[i]],
+                    "category": cats[self.category_codes[i]],
+                    "amount": float(self.amounts[i]),
+                    "note": self.notes[i] or "",
+                }
+                for i in range(lo, hi)
+            ]
@@ -0,0 +1,194 @@
+# planning.py — 财务规划计算：规则现金流向量（按规则版本缓存）+ 情景网格广播计算
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# 现金流缓存：(rules_version, 起始年, 起始月, 月数) -> (income, expense)
+_CF_CACHE_SIZE = 32
+_cf_cache = OrderedDict()
+_cf_lock = threading.Lock()
+
+
+def month_labels(y: int, m: int, months: int):
+    base = y * 12 + (m - 1)
+    return [f"{(base + t) // 12:04d}-{(base + t) % 12 + 1:02d}" for t in range(months)]
+
+
+def rule_cashflows(rules, y: int, m: int, months: int):
+    """
+    rules: [(type, amount, start_date, end_date, growth_rate), ...]
+    返回从 (y, m) 起 months 个月的 (income, expense) 两个 float64 向量；
+    与 in_month_window / amount_at_month 的口径一致（按月窗口、按年复合增长）。
+    """
+    income = np.zeros(months)
+    expense = np.zeros(months)
+    if not rules or months <= 0:
+        return income, expense
+    idx = y * 12 + (m - 1) + np.arange(months)            # 绝对月序号
+    for typ, amount, start, end, growth in rules:
+        s = start.year * 12 + (start.month - 1)
+        e = end.year * 12 + (end.month - 1) if end else None
+        mask = idx >= s
+        if e is not None:
+            mask &= idx <= e
+        if not mask.any():
+            continue
+        g = float(growth or 0.0)
+        if g == 0:
+            amt = np.full(months, float(amount))
+        else:
+            amt = float(amount) * np.power(1.0 + g, (idx - s) / 12.0)
+        if typ == '收入':
+            income += np.where(mask, amt, 0.0)
+        else:
+            expense += np.where(mask, amt, 0.0)
+    return income, expense
+
+
+def cached_cashflows(version, y: int, m: int, months: int, load_rules):
+    """按规则版本缓存现金流；规则有增删改时版本号变化，旧缓存自然失效"""
+    key = (version, y, m, months)
+    with _cf_lock:
+        hit = _cf_cache.get(key)
+        if hit is not None:
+            _cf_cache.move_to_end(key)
+            return hit
+    income, expense = rule_cashflows(load_rules(), y, m, months)
+    income.setflags(write=False)
+    expense.setflags(write=False)
+    with _cf_lock:
+        _cf_cache[key] = (income, expense)
+        while len(_cf_cache) > _CF_CACHE_SIZE:
+            _cf_cache.popitem(last=False)
+    return income, expense
+
+
+def wealth_grid(net, annual_returns, start_values, extra_monthly=(0.0,), inflation=(0.0,), idx=None):
+    """
+    一次广播算完所有情景的财富曲线。
+    递推 W_{t+1} = W_t * g + net_t + extra，g = (1+年化)^(1/12)，展开为
+      W_t = S * g^t + g^(t-1) * Σ_{k<t} net_k * g^(-k) + extra * (g^t - 1) / (g - 1)
+    通胀只做折现：实际财富 = 名义财富 / (1+通胀)^(t/12)。
+    idx 为采样月份下标（可选）：各项只在 (n_return, months) 上算全长，广播前先按 idx 取列，
+    大数组只有采样点那么宽。
+    返回 shape = (n_return, n_start, n_extra, n_inflation, len(idx) 或 months)。
+    """
+    net = np.asarray(net, dtype=float)
+    T = net.shape[0]
+    R = np.maximum(np.asarray(annual_returns, dtype=float), -0.999)
+    S = np.asarray(start_values, dtype=float)
+    E = np.asarray(extra_monthly, dtype=float)
+    I = np.asarray(inflation, dtype=float)
+
+    t = np.arange(1, T + 1)
+    g = np.power(1.0 + R, 1.0 / 12.0)[:, None]                     # (nr, 1)
+    gt = np.power(g, t)                                            # (nr, T)
+    flows = g ** (t - 1) * np.cumsum(net * np.power(g, -(t - 1)), axis=1)
+    near_one = np.abs(g - 1.0) < 1e-12
+    annuity = np.where(near_one, t.astype(float), (gt - 1.0) / np.where(near_one, 1.0, g - 1.0))
+    if idx is not None:
+        idx = np.asarray(idx, dtype=np.intp)
+        gt, flows, annuity, t = gt[:, idx], flows[:, idx], annuity[:, idx], t[idx]
+
+    nominal = (gt[:, None, None, :] * S[None, :, None, None]
+               + flows[:, None, None, :]
+               + annuity[:, None, None, :] * E[None, None, :, None])  # (nr, ns, ne, 采样点数)
+    deflator = np.power(1.0 + I[:, None], t[None, :] / 12.0)          # (ni, 采样点数)
+    return nominal[:, :, :, None, :] / deflator[None, None, None, :, :]
+
+
+def sample_indices(months: int, step: int):
+    """每 step 个月取一个点，保证包含最后一个月"""
+    step = max(1, int(step))
+    idx = list(range(step - 1, months, step))
+    if not idx or idx[-1] != months - 1:
+        idx.append(months - 1)
+    return idx
+
+
+# ---------------- 目标求解（反推收益率 / 月储蓄 / 起始资产） ----------------
+def terminal_wealth(net, annual_returns, start_value, extra_monthly=0.0):
+    """T 个月后的财富，对 annual_returns 向量化：W_T = S g^T + Σ net_k g^(T-1-k) + e·年金系数"""
+    net = np.asarray(net, dtype=float)
+    T = net.shape[0]
+    R = np.maximum(np.atleast_1d(np.asarray(annual_returns, dtype=float)), -0.999)
+    g = np.power(1.0 + R, 1.0 / 12.0)
+    powers = np.power(g[:, None], np.arange(T - 1, -1, -1)[None, :])     # (n, T)
+    annuity = powers.sum(axis=1)
+    return start_value * np.power(g, T) + powers @ net + extra_monthly * annuity
+
+
+def _linear_terms(net, annual_return):
+    """固定收益率下 W_T 对 S、e 都是线性的，返回 (g^T, Σ net_k g^(T-1-k), 年金系数)"""
+    net = np.asarray(net, dtype=float)
+    T = net.shape[0]
+    g = (1.0 + max(float(annual_return), -0.999)) ** (1.0 / 12.0)
+    powers = np.power(g, np.arange(T - 1, -1, -1))
+    return g ** T, float(powers @ net), float(powers.sum())
+
+
+def solve_return(net, target, start_value, extra_monthly=0.0, lo=-0.99, hi=1.0,
+                 grid=2001, rounds=4, width=64):
+    """
+    反推需要的年化收益率，返回 (收益率, 方法) 或 (None, 原因)。
+    现金流全为 0 时直接用复利公式；否则先在 [lo, hi] 上整体网格找第一个变号区间，
+    再逐轮在区间内铺 width 个点收窄（每轮一次向量化求值），几轮即到 1e-10 精度。
+    两种做法都受 [lo, hi] 约束：下限收益就已达标时返回 (lo, "lower_bound")。
+    """
+    net = np.asarray(net, dtype=float)
+    T = net.shape[0]
+    if not np.any(net) and extra_monthly == 0 and start_value > 0 and target > 0:
+        r = (target / start_value) ** (12.0 / T) - 1.0
+        if r <= lo:
+            return float(lo), "lower_bound"
+        if r > hi:
+            return None, "unreachable"
+        return r, "closed_form"
+
+    xs = np.linspace(lo, hi, grid)
+    f = terminal_wealth(net, xs, start_value, extra_monthly) - target
+    if f[0] >= 0:
+        return float(xs[0]), "lower_bound"
+    cross = np.nonzero(f >= 0)[0]
+    if cross.size == 0:
+        return None, "unreachable"
+    a, b = xs[cross[0] - 1], xs[cross[0]]
+    for _ in range(rounds):
+        xs = np.linspace(a, b, width)
+        f = terminal_wealth(net, xs, start_value, extra_monthly) - target
+        k = int(np.nonzero(f >= 0)[0][0])
+        a, b = xs[max(k - 1, 0)], xs[k]
+    return float(b), "bisection"
+
+
+def solve_plan(net, target, solve_for, annual_return=0.06, start_value=0.0, extra_monthly=0.0,
+               bounds=(-0.99, 1.0)):
+    """
+    solve_for:
+      annual_return  —— 需要的年化收益率（数值求解）
+      extra_monthly  —— 每月还需额外储蓄多少（线性，闭式）
+      start_value    —— 起始需要多少资产（线性，闭式）
+    返回 dict：value / method / final_wealth（代回验算）；无解时 value 为 None。
+    不追加储蓄 / 起始为 0 就已达标时，value 取 0，method 为 already_reached。
+    """
+    if solve_for == "annual_return":
+        value, method = solve_return(net, target, start_value, extra_monthly, *bounds)
+        if value is None:
+            return {"value": None, "method": method}
+        final = float(terminal_wealth(net, [value], start_value, extra_monthly)[0])
+        return {"value": value, "method": method, "final_wealth": final}
+
+    gT, flows, annuity = _linear_terms(net, annual_return)
+    if solve_for == "extra_monthly":
+        value = (target - start_value * gT - flows) / annuity
+        final = start_value * gT + flows + value * annuity
+    elif solve_for == "start_value":
+        value = (target - flows - extra_monthly * annuity) / gT
+        final = value * gT + flows + extra_monthly * annuity
+    else:
+        raise ValueError(f"unknown solve_for: {solve_for}")
+    if value < 0:
+        final -= value * (annuity if solve_for == "extra_monthly" else gT)
+        return {"value": 0.0, "method": "already_reached", "final_wealth": float(final)}
+    return {"value": float(value), "method": "closed_form", "final_wealth": float(final)}
@@ -3,8 +3,12 @@ import os
 import re
 import json
 import time
+from datetime import datetime
+
 import requests
 
+from rate_limit import allow, SingleFlight
+
 # =============== 环境变量（兼容两种命名） ===============
 ALPHA_KEY = os.getenv("ALPHA_VANTAGE_API_KEY") or os.getenv("ALPHAVANTAGE_API_KEY")
 
@@ -64,6 +68,8 @@ def eastmoney_stock_quote(code: str):
     p = guess_exchange(code)
     if not p:
         return None
+    if not allow("eastmoney"):
+        return None
     url = "https://push2.eastmoney.com/api/qt/stock/get"
     params = {"secid": f"{p}.{code}", "fields": "f43,f57,f58,f169,f170"}  # f43最新价, f57代码, f58名称
     try:
@@ -79,6 +85,8 @@ def eastmoney_stock_quote(code: str):
         return None
 
 def eastmoney_fund_quote(fund_code: str):
+    if not allow("eastmoney"):
+        return None
     url = f"https://fundgz.1234567.com.cn/js/{fund_code}.js"
     try:
         r = requests.get(url, timeout=12, headers={"Referer": "https://fund.eastmoney.com/"})
@@ -97,6 +105,8 @@ def eastmoney_fund_quote(fund_code: str):
 
 def eastmoney_fund_quote_robust(fund_code: str):
     """抓净值 HTML 兜底"""
+    if not allow("eastmoney"):
+        return None
     url = f"http://fund.eastmoney.com/f10/jshs_{fund_code}.html"
     headers = {'User-Agent': 'Mozilla/5.0'}
     try:
@@ -117,6 +127,8 @@ def eastmoney_fund_quote_robust(fund_code: str):
 
 # =============== Alpha Vantage（搜索 & 报价） ===============
 def _alpha_symbol_search(search_term: str):
+    if not allow("alpha"):
+        return []
     try:
         r = requests.get(
             "https://www.alphavantage.co/query",
@@ -148,6 +160,8 @@ def _alpha_symbol_search(search_term: str):
 def alpha_quote(symbol: str):
     if not ALPHA_KEY:
         return None
+    if not allow("alpha"):
+        return None
     try:
         r = requests.get(
             "https://www.alphavantage.co/query",
@@ -171,6 +185,8 @@ _Y_HEADERS = {
 }
 
 def yahoo_search(q: str):
+    if not allow("yahoo"):
+        return []
     try:
         r = requests.get(
             "https://query2.finance.yahoo.com/v1/finance/search",
@@ -197,6 +213,8 @@ def yahoo_search(q: str):
         return []
 
 def _yahoo_quote_v7(symbol: str) -> QuoteResult | None:
+    if not allow("yahoo"):
+        return None
     try:
         r = requests.get(
             "https://query1.finance.yahoo.com/v7/finance/quote",
@@ -228,6 +246,8 @@ def _yahoo_quote_v7(symbol: str) -> QuoteResult | None:
 
 def _yahoo_quote_chart(symbol: str) -> QuoteResult | None:
     """v8 chart 兜底：从 meta.regularMarketPrice / previousClose 取值"""
+    if not allow("yahoo"):
+        return None
     try:
         r = requests.get(
             f"https://query1.finance.yahoo.com/v8/finance/chart/{symbol}",
@@ -274,6 +294,8 @@ def _stooq_quote(symbol: str) -> QuoteResult | None:
         if s.endswith(".us"): currency = "USD"
         if s.endswith(".ks") or s.endswith(".kq"): currency = "KRW"
     url = f"https://stooq.com/q/l/?s={stooq_sym}&i=d"
+    if not allow("stooq"):
+        return None
     try:
         r = requests.get(url, timeout=8)
         text = r.text.strip()
@@ -313,10 +335,63 @@ def yahoo_quote(symbol: str) -> QuoteResult | None:
     # 最后 Stooq
     return _stooq_quote(s)
 
+# =============== 日线历史（供风险参数估计） ===============
+def _yahoo_history_symbol(symbol: str) -> str:
+    """A 股代码转成 Yahoo 写法：600000.SH -> 600000.SS；纯 6 位数字按交易所补后缀"""
+    s = (symbol or "").strip().upper()
+    if s.endswith(".SH"):
+        return s[:-3] + ".SS"
+    if s.isdigit() and len(s) == 6:
+        ex = guess_exchange(s)
+        if ex:
+            return s + (".SZ" if ex == '0' else ".SS")
+    return s
+
+def yahoo_daily_history(symbol: str, range_: str = "5y"):
+    """
+    Yahoo v8 chart 日线：返回 [(date, close), ...]（日期升序，优先用复权价）。
+    失败/限流时返回空列表。
+    """
+    if not allow("yahoo"):
+        return []
+    ysym = _yahoo_history_symbol(symbol)
+    try:
+        r = requests.get(
+            f"https://query1.finance.yahoo.com/v8/finance/chart/{ysym}",
+            params={"range": range_, "interval": "1d"},
+            headers={**_Y_HEADERS, "Referer": f"https://finance.yahoo.com/quote/{ysym}"},
+            timeout=15
+        )
+        res = ((r.json().get("chart") or {}).get("result") or [])
+        if not res:
+            print("[yahoo history] empty, status=", r.status_code, "body[:200]=", r.text[:200])
+            return []
+        x = res[0]
+        offset = (x.get("meta") or {}).get("gmtoffset") or 0
+        ind = x.get("indicators") or {}
+        closes = ((ind.get("adjclose") or [{}])[0].get("adjclose")
+                  or (ind.get("quote") or [{}])[0].get("close") or [])
+        out = []
+        for ts, c in zip(x.get("timestamp") or [], closes):
+            if c is None or c <= 0:
+                continue
+            out.append((datetime.utcfromtimestamp(ts + offset).date(), float(c)))
+        return out
+    except Exception as e:
+        print("[yahoo history] error:", e)
+        return []
+
 # =============== 对外函数（保持你的签名） ===============
+# 相同关键词/代码的并发请求合并成一次上游调用
+_search_flight = SingleFlight()
+_quote_flight = SingleFlight()
+
 def alpha_search(query: str):
     """Alpha 搜索 + Yahoo 兜底；A股六位数直接回填候选"""
     q = (query or "").strip()
+    return _search_flight.do(q.upper(), _alpha_search, q)
+
+def _alpha_search(q: str):
     # 翻译字典优先（如 159202）
     mapped_code = TRANSLATION_MAP.get(q)
     if mapped_code and mapped_code.isdigit():
@@ -364,9 +439,12 @@ def smart_quote(symbol_or_code: str):
     """
     A股/基金：东方财富；否则 Alpha -> Yahoo (v7->v8->Stooq) 兜底。
     只有 000001.SZ / 600000.SH 这类才按 A 股处理；'005930.KS' 不再误判为 A 股。
+    同一代码的并发请求只会触发一次上游抓取。
     """
     s = (symbol_or_code or "").strip()
+    return _quote_flight.do(s.upper(), _smart_quote, s)
 
+def _smart_quote(s: str):
     # 1) 纯 6 位数字：优先视为 A 股/ETF
     if s.isdigit() and len(s) == 6:
         q_stock = eastmoney_stock_quote(s)
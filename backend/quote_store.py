@@ -0,0 +1,159 @@
+# quote_store.py — 最近一次成功报价的内存缓存 + SQLite 持久化（批量写）
+# 上游全挂/限流时仍能返回“最后已知价格”（带时效），启动时从表里预热，离线也能估值。
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+_DEFAULT_DB = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data.sqlite")
+QUOTE_STORE_DB = os.getenv("QUOTE_STORE_DB") or os.getenv("SQLITE_PATH") or _DEFAULT_DB
+
+FLUSH_BATCH = 20          # 攒够这么多条立即落盘
+FLUSH_INTERVAL = 30.0     # 否则最多隔这么久落盘一次（秒）
+
+
+class QuoteStore:
+    def __init__(self, db_path: str = QUOTE_STORE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._cache = {}            # key -> (payload dict, fetched_at)
+        self._pending = {}          # 待落盘，同一代码只留最新
+        self._refreshing = set()
+        self._warmed = threading.Event()
+        self._flusher = None
+
+    @staticmethod
+    def key(symbol: str) -> str:
+        return (symbol or "").strip().upper()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS last_quotes ("
+            "symbol TEXT PRIMARY KEY, price REAL, payload TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        return conn
+
+    # ---------- 预热 / 落盘 ----------
+    def warm(self):
+        """从 last_quotes 全量载入内存；只在进程内第一次调用时真正读库"""
+        if self._warmed.is_set():
+            return
+        with self._lock:
+            if self._warmed.is_set():
+                return
+            try:
+                conn = self._connect()
+                try:
+                    rows = conn.execute("SELECT symbol, payload, fetched_at FROM last_quotes").fetchall()
+                finally:
+                    conn.close()
+                for sym, payload, fetched_at in rows:
+                    if sym not in self._cache:
+                        self._cache[sym] = (json.loads(payload), fetched_at)
+            except sqlite3.Error as e:
+                print("[quote_store] warm error:", e)
+            self._warmed.set()
+
+    def flush(self):
+        # 多个 worker 共用一张表：只用更新的报价覆盖旧的，晚到的旧批次不会把新价格写回去
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO last_quotes (symbol, price, payload, fetched_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(symbol) DO UPDATE SET price = excluded.price, payload = excluded.payload, "
+                        "fetched_at = excluded.fetched_at WHERE excluded.fetched_at > last_quotes.fetched_at",
+                        [(k, p.get("price"), json.dumps(p, ensure_ascii=False), t) for k, (p, t) in batch.items()],
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print("[quote_store] flush error:", e)
+            with self._lock:
+                for k, v in batch.items():
+                    self._pending.setdefault(k, v)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="quote-store-flush", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    # ---------- 读写 ----------
+    def record(self, symbol: str, quote) -> None:
+        """记录一次成功报价（price 非空）；内存立即可见，落盘按批"""
+        if quote is None or quote.price is None:
+            return
+        k = self.key(symbol)
+        entry = (quote.to_json(), time.time())
+        with self._lock:
+            self._cache[k] = entry
+            self._pending[k] = entry
+            n = len(self._pending)
+            self._ensure_flusher()
+        if n >= FLUSH_BATCH:
+            self.flush()
+
+    def get(self, symbol: str):
+        """返回 (报价 dict, 距上次成功抓取的秒数)；没有记录时返回 None"""
+        self.warm()
+        hit = self._cache.get(self.key(symbol))
+        if hit is None:
+            return None
+        payload, fetched_at = hit
+        return dict(payload), max(0.0, time.time() - fetched_at)
+
+    def fetch(self, symbol: str, fetch_fn):
+        """调用上游并记录成功结果"""
+        q = fetch_fn(symbol)
+        self.record(symbol, q)
+        return q
+
+    def refresh_async(self, symbol: str, fetch_fn) -> None:
+        """后台刷新；同一代码已在刷新时不重复起线程"""
+        k = self.key(symbol)
+        with self._lock:
+            if k in self._refreshing:
+                return
+            self._refreshing.add(k)
+
+        def run():
+            try:
+                self.fetch(symbol, fetch_fn)
+            except Exception as e:
+                print("[quote_store] refresh error:", symbol, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(k)
+
+        threading.Thread(target=run, name=f"quote-refresh-{k}", daemon=True).start()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> QuoteStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = QuoteStore()
+        return _store
+
+
+def warm_in_background() -> None:
+    """启动时调用：后台线程预热，不拖慢第一个请求"""
+    threading.Thread(target=get_store().warm, name="quote-store-warm", daemon=True).start()
@@ -0,0 +1,170 @@
+# rate_limit.py — 行情源限流（令牌桶，跨线程/跨 worker 共享）+ 同参请求合并（single-flight）
+import os
+import sqlite3
+import threading
+import time
+
+# 令牌桶状态放在 SQLite 里，gunicorn 多个 worker 共用同一份额度（默认与应用同库，跟随 SQLITE_PATH）
+_DEFAULT_DB = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data.sqlite")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB") or os.getenv("SQLITE_PATH") or _DEFAULT_DB
+
+# 拿共享令牌时最多等锁这么久（秒）；等不到就当作本次没有额度，直接切下一个数据源
+LOCK_TIMEOUT = 0.25
+
+_tables_ready = set()
+_tables_lock = threading.Lock()
+
+# 默认额度：provider -> (容量, 每多少秒补满)；可用环境变量覆盖，如 RATE_LIMIT_ALPHA="5/60"
+DEFAULT_LIMITS = {
+    "alpha": (5, 60.0),        # Alpha Vantage 免费档：每分钟 5 次
+    "yahoo": (30, 60.0),       # Yahoo 容易 429，保守一点
+    "stooq": (30, 60.0),
+    "eastmoney": (60, 60.0),
+}
+
+
+def _parse_limit(raw: str, fallback):
+    try:
+        cap, per = raw.split("/", 1)
+        return int(cap), float(per)
+    except Exception:
+        return fallback
+
+
+class TokenBucket:
+    """
+    令牌桶：capacity 个令牌，每 per 秒匀速补满。
+    try_acquire() 不等待：没有令牌直接返回 False，调用方应立即切到下一个数据源。
+    进程内用锁保证线程安全；跨进程用 SQLite 的 BEGIN IMMEDIATE 串行化读写。
+    库被锁住时本次按“无额度”处理，但下次仍走共享路径，保证跨 worker 的限额一直有效。
+    """
+
+    def __init__(self, name: str, capacity: int, per: float, db_path: str = None):
+        self.name = name
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per if per > 0 else float("inf")
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # 共享库打不开（非锁冲突）时，本次调用退化为进程内计数
+        self._tokens = self.capacity
+        self._updated = time.time()
+
+    def _refill(self, tokens: float, updated: float, now: float) -> float:
+        return min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+
+    def _acquire_local(self, now: float) -> bool:
+        self._tokens = self._refill(self._tokens, self._updated, now)
+        self._updated = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    def _ensure_table(self, conn) -> None:
+        """每个库文件只建一次表"""
+        with _tables_lock:
+            if self.db_path in _tables_ready:
+                return
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                "provider TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            _tables_ready.add(self.db_path)
+
+    def _acquire_shared(self, now: float) -> bool:
+        conn = sqlite3.connect(self.db_path, timeout=LOCK_TIMEOUT, isolation_level=None)
+        try:
+            self._ensure_table(conn)
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_buckets WHERE provider = ?", (self.name,)
+            ).fetchone()
+            tokens = self._refill(row[0], row[1], now) if row else self.capacity
+            ok = tokens >= 1.0
+            if ok:
+                tokens -= 1.0
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (provider, tokens, updated) VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+            conn.execute("COMMIT")
+            return ok
+        finally:
+            conn.close()
+
+    def try_acquire(self) -> bool:
+        now = time.time()
+        with self._lock:
+            if self.db_path:
+                try:
+                    return self._acquire_shared(now)
+                except sqlite3.OperationalError as e:
+                    if "locked" in str(e) or "busy" in str(e):
+                        print(f"[rate_limit] {self.name} 共享令牌桶被占用，本次跳过")
+                        return False
+                    print(f"[rate_limit] {self.name} 共享令牌桶不可用，本次改用进程内计数: {e}")
+                except sqlite3.Error as e:
+                    print(f"[rate_limit] {self.name} 共享令牌桶不可用，本次改用进程内计数: {e}")
+            return self._acquire_local(now)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(provider: str) -> TokenBucket:
+    with _buckets_lock:
+        b = _buckets.get(provider)
+        if b is None:
+            fallback = DEFAULT_LIMITS.get(provider, (60, 60.0))
+            cap, per = _parse_limit(os.getenv(f"RATE_LIMIT_{provider.upper()}", ""), fallback)
+            b = TokenBucket(provider, cap, per, db_path=RATE_LIMIT_DB)
+            _buckets[provider] = b
+        return b
+
+
+def allow(provider: str) -> bool:
+    """该数据源当前是否还有额度；没有时打印一行日志，方便排查"""
+    ok = get_bucket(provider).try_acquire()
+    if not ok:
+        print(f"[rate_limit] {provider} 额度已用完，跳过")
+    return ok
+
+
+# =============== single-flight：相同 key 的并发请求只打一次上游 ===============
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()